@@ -1,43 +1,68 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import re
+import csv
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO, BytesIO
-from functools import reduce
+from functools import lru_cache, partial, reduce
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 
+# Engine Excel opsional yang jauh lebih cepat (pandas >= 2.2 + python-calamine)
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = None
+
+# Writer CSV Arrow (pyarrow ikut terpasang bersama streamlit); fallback ke writer pandas
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.feather as pa_feather
+except ImportError:
+    pa = pa_csv = pa_feather = None
+
+# pandas >= 3: Copy-on-Write selalu aktif dan dtype 'str' default berbasis Arrow
+PANDAS_3 = int(pd.__version__.split('.')[0]) >= 3
+
+# Copy-on-Write: salinan defensif (.copy()) sebelum assign kolom tidak diperlukan.
+# Di pandas >= 3.0 CoW selalu aktif dan opsi ini sudah deprecated.
+if not PANDAS_3:
+    pd.options.mode.copy_on_write = True
+
 
 # ==============================================================================
 # KELAS KALKULATOR DETERMINISTIK (TIDAK BERUBAH)
 # ==============================================================================
-def extract_number(nocontainer):
-    # Mengekstrak hanya digit dari string
-    return ''.join(filter(str.isdigit, str(nocontainer)))
+NON_DIGIT_PATTERN = r'\D+'
 
-def get_container_size_grade(nocontainer):
-    try:
-        # Ekstrak hanya bagian numerik dari nomor kontainer
-        numeric_part = extract_number(nocontainer)
-        if not numeric_part:  # Jika tidak ada angka
-            return "Others", "Others"
-            
-        nomor = int(numeric_part)
-        if 2500000 <= nomor <= 2759999:
-            return "20", "C"
-        elif 2760000 <= nomor <= 2899999:
-            return "20", "B"
-        elif 2900000 <= nomor < 3500000:
-            return "20", "A"
-        elif 4600000 <= nomor <= 4619999:
-            return "40", "C"
-        elif 4620000 <= nomor < 4629999:
-            return "40", "B"
-        elif nomor >= 4630000:
-            return "40", "A"
-        else:
-            return "Others", "Others"
-    except:
-        return "Others", "Others"
+def extract_number_series(nocontainer: pd.Series) -> pd.Series:
+    # Mengekstrak hanya digit dari nomor kontainer: satu pass regex untuk seluruh kolom
+    return nocontainer.astype(str).str.replace(NON_DIGIT_PATTERN, '', regex=True)
+
+# Batas rentang nomor kontainer (side='right') beserta label ukuran/grade per bin:
+# 2.500.000-2.759.999 = 20/C, 2.760.000-2.899.999 = 20/B, 2.900.000-3.499.999 = 20/A,
+# 4.600.000-4.619.999 = 40/C, 4.620.000-4.629.998 = 40/B, >= 4.630.000 = 40/A, sisanya Others.
+CONTAINER_NUMBER_EDGES = np.array([2500000, 2760000, 2900000, 3500000, 4600000, 4620000, 4629999, 4630000])
+CONTAINER_SIZE_LABELS = np.array(["Others", "20", "20", "20", "Others", "40", "40", "Others", "40"], dtype=object)
+CONTAINER_GRADE_LABELS = np.array(["Others", "C", "B", "A", "Others", "C", "B", "Others", "A"], dtype=object)
+
+def get_container_size_grade_series(nocontainer: pd.Series):
+    """
+    Ukuran dan grade kontainer dari nomor kontainer untuk satu kolom sekaligus.
+    Mengembalikan dua Series (ukuran, grade) dengan index yang sama dengan input.
+    """
+    numeric_part = extract_number_series(nocontainer)
+    nomor = pd.to_numeric(numeric_part, errors='coerce').to_numpy(dtype=float)
+    idx = np.searchsorted(CONTAINER_NUMBER_EDGES, np.nan_to_num(nomor, nan=-1), side='right')
+    idx[np.isnan(nomor)] = 0  # Tanpa angka -> "Others"
+    sizes = pd.Series(CONTAINER_SIZE_LABELS[idx], index=nocontainer.index)
+    grades = pd.Series(CONTAINER_GRADE_LABELS[idx], index=nocontainer.index)
+    return sizes, grades
 
 class DeterministicCostCalculator:
     """
@@ -46,7 +71,17 @@ class DeterministicCostCalculator:
     deterministik, bukan model machine learning.
     """
     def __init__(self, master_material_df: pd.DataFrame):
-        self.master_material = master_material_df
+        # Kolom numerik master dikonversi sekali di sini (float64: harga Rupiah), bukan di setiap run_pipeline
+        self.master_numeric_cols = ['COSTMATERIAL', 'SURCHARGE', 'MHR_SPIL', 'MHR_VENDOR']
+        master_numeric = master_material_df[self.master_numeric_cols].apply(
+            pd.to_numeric, errors='coerce'
+        ).astype('float64')
+        # assign mengembalikan frame baru, sehingga master milik pemanggil tidak ikut berubah
+        self.master_material = master_material_df.assign(**{col: master_numeric[col] for col in self.master_numeric_cols})
+        # Master diindeks per MATERIAL sekali agar join di run_pipeline memakai index yang sama
+        self.master_indexed = self.master_material.set_index('MATERIAL').sort_index()
+        # Daftar material master disimpan sekali untuk pengecekan keanggotaan (isin berbasis hash)
+        self.master_materials = master_material_df['MATERIAL']
         self.depo_config = {
             "SBY": {"vendors": ['MTCP', 'SPIL']},
             "JKT": {"vendors": ['SPIL','MCPNL', 'MDS', 'MDSBC', 'MAC', 'MACBC', 'ABC']}
@@ -64,24 +99,95 @@ class DeterministicCostCalculator:
 
             "SBY": {'MTCP': ['A', 'B', 'C','Others'], 'SPIL': ['A', 'B', 'C','Others']}
         }
+        self.vendors_by_depo = {depo: cfg["vendors"] for depo, cfg in self.depo_config.items()}
+        self.depo_categories = list(self.depo_config)
+        self.grade_categories = ['A', 'B', 'C', 'Others']
+        # Diurutkan alfabetis: urutan kolom vendor hasil agregasi mengikuti urutan kategori ini
+        self.vendor_categories = sorted({v for vendors in self.vendors_by_depo.values() for v in vendors})
+
+        # Aturan vendor sebagai larik: matriks (depo x vendor) untuk keanggotaan dan tarif labour,
+        # vektor (vendor) untuk sumber MHR dan surcharge. Kolom mengikuti vendor_categories.
+        self.vendor_in_depo = np.zeros((len(self.depo_categories), len(self.vendor_categories)), dtype=bool)
+        self.labour_by_depo = np.zeros((len(self.depo_categories), len(self.vendor_categories)))
+        for i, depo in enumerate(self.depo_categories):
+            for vendor in self.vendors_by_depo[depo]:
+                j = self.vendor_categories.index(vendor)
+                self.vendor_in_depo[i, j] = True
+                # SPIL SBY memakai tarif default 14.000, SPIL JKT ditimpa menjadi 21.500
+                self.labour_by_depo[i, j] = 21500 if (vendor == "SPIL" and depo == "JKT") else self.labourvendor_dict[vendor]
+        self.use_spil_mhr = np.array([vendor == "SPIL" for vendor in self.vendor_categories])
+        self.apply_surcharge = np.array([vendor in self.surcharge_vendor for vendor in self.vendor_categories])
+
+    def sum_per_eor_vendor(self, df_rows: pd.DataFrame) -> pd.DataFrame:
+        """
+        Menghitung MHR dan HARGA_TOTAL untuk setiap (baris input, vendor) sebagai grid 2D
+        hasil broadcast antara nilai per baris dan aturan per vendor, lalu menjumlahkannya
+        per NO_EOR dalam format lebar (kolom MHRTOTAL_<vendor> lalu HARGATOTAL_<vendor>).
+        Sel (EOR, vendor) tanpa baris bernilai NaN.
+        """
+        codes_eor, eor_uniq = pd.factorize(df_rows["NO_EOR"], sort=False)
+        depo_codes = df_rows["DEPO"].cat.codes.to_numpy()
+        keep = (codes_eor >= 0) & (depo_codes >= 0)  # NO_EOR/DEPO kosong diabaikan
+        codes_eor, depo_codes = codes_eor[keep], depo_codes[keep]
+
+        def row_values(col):
+            return df_rows[col].fillna(0).to_numpy(dtype=np.float64)[keep]
+
+        # (N, V): vendor mana yang berlaku untuk depo setiap baris, beserta tarif labournya
+        active = self.vendor_in_depo[depo_codes]
+        labour = self.labour_by_depo[depo_codes]
+        mhr = np.where(self.use_spil_mhr, row_values("MHR_SPIL")[:, None], row_values("MHR_VENDOR")[:, None])
+
+        # HARGA_TOTAL = QTY * (MHR * LABOURVENDOR + COSTMATERIAL + SURCHARGE_FIX),
+        # dihitung in-place pada satu buffer grid
+        harga = np.multiply(mhr, labour)
+        harga += row_values("COSTMATERIAL")[:, None]
+        harga += row_values("SURCHARGE")[:, None] * self.apply_surcharge
+        harga *= row_values("QTY")[:, None]
+
+        n_vendor = len(self.vendor_categories)
+        n_cells = len(eor_uniq) * n_vendor
+        flat = (codes_eor[:, None] * n_vendor + np.arange(n_vendor)).ravel()
+
+        def scatter_sum(grid):
+            weights = np.where(active, grid, 0).ravel()
+            return np.bincount(flat, weights=weights, minlength=n_cells).reshape(-1, n_vendor)
+
+        counts = np.bincount(flat, weights=active.ravel(), minlength=n_cells).reshape(-1, n_vendor)
+        # Hanya vendor yang muncul; urutan kolom mengikuti kategori vendor (alfabetis) karena
+        # menentukan urutan kandidat vendor saat harga sama di tahap alokasi
+        observed = counts.any(axis=0)
+        vendors = np.asarray(self.vendor_categories)[observed]
+        present = counts[:, observed] > 0
+        blocks = [np.where(present, scatter_sum(grid)[:, observed], np.nan) for grid in [mhr, harga]]
+        columns = [f"{metric}_{vendor}" for metric in ["MHRTOTAL", "HARGATOTAL"] for vendor in vendors]
+        # Tetap float64: total Rupiah jutaan kehilangan presisi di float32, dan total MHR
+        # dibandingkan langsung dengan sisa kapasitas saat alokasi
+        return pd.DataFrame(np.hstack(blocks), index=pd.Index(eor_uniq, name="NO_EOR"), columns=columns)
 
     def run_pipeline(self, input_data: pd.DataFrame, calculation_option: str) -> pd.DataFrame:
         """
         Fungsi utama yang menjalankan seluruh proses kalkulasi.
         Nama fungsi 'run_pipeline' dipertahankan agar kompatibel dengan sisa dashboard.
         """
+        # Kolom berkardinalitas kecil dijadikan kategori agar groupby/merge memakai kode integer
+        input_data = input_data.assign(
+            DEPO=pd.Categorical(input_data['DEPO'], categories=self.depo_categories),
+            CONTAINER_GRADE=pd.Categorical(input_data['CONTAINER_GRADE'], categories=self.grade_categories),
+            QTY=pd.to_numeric(input_data['QTY'], errors='coerce').astype('float64')
+        )
+        # Depo yang ada di input dihitung sekali untuk seluruh langkah di bawah
+        depos = input_data['DEPO'].dropna().drop_duplicates().tolist()
+
         # --- PERUBAHAN LOGIKA PERINGATAN ---
         # Gabungkan data input dengan master material terlebih dahulu
-        df_merged = pd.merge(input_data, self.master_material, on="MATERIAL", how="left")
+        df_merged = input_data.join(self.master_indexed, on="MATERIAL", how="left")
 
-        # Definisikan kolom yang akan diperiksa kelengkapannya di master
-        cols_to_check = ['COSTMATERIAL', 'SURCHARGE', 'MHR_SPIL', 'MHR_VENDOR']
-        for col in cols_to_check:
-            if col in df_merged.columns:
-                df_merged[col] = pd.to_numeric(df_merged[col], errors='coerce')
+        # Kolom yang diperiksa kelengkapannya di master (sudah numerik sejak __init__)
+        cols_to_check = self.master_numeric_cols
 
-        # Kondisi 1: Material tidak ada di master (ditandai dengan NaN setelah left merge)
-        missing_material_cond = df_merged['MHR_VENDOR'].isnull()
+        # Kondisi 1: Material tidak ada di master
+        missing_material_cond = ~df_merged['MATERIAL'].isin(self.master_materials)
 
         # Kondisi 2: Material ada, tetapi datanya tidak lengkap (NaN)
         incomplete_data_cond = ~missing_material_cond & (
@@ -89,15 +195,14 @@ class DeterministicCostCalculator:
         )
 
         # Beri tanda 'WARNING' jika salah satu kondisi terpenuhi
-        df_merged['WARNING'] = np.where(missing_material_cond | incomplete_data_cond, 1, 0)
+        df_merged['WARNING'] = (missing_material_cond | incomplete_data_cond).astype(np.int8)
 
         # Hitung total warning per EOR dari dataframe yang sudah digabung
-        warning_counts = df_merged.groupby('NO_EOR')['WARNING'].sum().reset_index()
-        warning_counts.rename(columns={'WARNING': 'WARNING_COUNT'}, inplace=True)
+        warning_counts = df_merged.groupby('NO_EOR', sort=False, observed=True)['WARNING'].sum()
         # --- AKHIR PERUBAHAN LOGIKA PERINGATAN ---
 
         # --- PENAMBAHAN FITUR: OPSI PERHITUNGAN ---
-        df_for_calculation = df_merged.copy()
+        df_for_calculation = df_merged
         if calculation_option == "Hanya hitung material lengkap (lewati nilai kosong)":
             # Filter out rows that have warnings before starting calculations
             df_for_calculation = df_for_calculation[df_for_calculation['WARNING'] == 0]
@@ -106,136 +211,430 @@ class DeterministicCostCalculator:
         base_cols = input_data[['NO_EOR', 'CONTAINER_GRADE', 'CONTAINER_TYPE', 'DEPO']].drop_duplicates(subset=['NO_EOR'])
         all_results_df = base_cols.set_index('NO_EOR')
 
-        for depo in df_for_calculation["DEPO"].unique():
-            df_depo = df_for_calculation[df_for_calculation["DEPO"] == depo].copy()
-            if df_depo.empty:
-                continue
-            vendors = self.depo_config.get(depo, {}).get("vendors", [])
-            if not vendors:
-                continue
-            
-            df_expanded = df_depo.loc[df_depo.index.repeat(len(vendors))].copy()
-            df_expanded["IDKONTRAKTOR"] = np.tile(vendors, len(df_depo))
-            # 1. Tetapkan biaya default untuk semua vendor dari dictionary
-            #    SPIL SBY akan otomatis mendapatkan harga 14.000 dari sini.
-            df_expanded["LABOURVENDOR"] = df_expanded["IDKONTRAKTOR"].map(self.labourvendor_dict)
-
-            # 2. Buat kondisi spesifik untuk SPIL di JKT
-            kondisi_spil_jkt = (df_expanded["IDKONTRAKTOR"] == "SPIL") & (df_expanded["DEPO"] == "JKT")
-
-            # 3. Timpa (overwrite) nilainya menjadi 21.500 hanya jika kondisi di atas terpenuhi
-            df_expanded.loc[kondisi_spil_jkt, "LABOURVENDOR"] = 21500
-            df_expanded["MHR"] = np.where(
-                df_expanded["IDKONTRAKTOR"] == "SPIL",
-                df_expanded["MHR_SPIL"],
-                df_expanded["MHR_VENDOR"]
-            )
-            df_expanded["SURCHARGE_FIX"] = np.where(
-                df_expanded["IDKONTRAKTOR"].isin(self.surcharge_vendor),
-                df_expanded["SURCHARGE"],
-                0
-            )
-            num_cols_to_fill = ['QTY', 'MHR', 'LABOURVENDOR', 'COSTMATERIAL', 'SURCHARGE_FIX']
-            for col in num_cols_to_fill:
-                df_expanded[col] = pd.to_numeric(df_expanded[col], errors='coerce').fillna(0)
-            df_expanded["HARGA_TOTAL"] = df_expanded["QTY"] * (
-                df_expanded["MHR"] * df_expanded["LABOURVENDOR"] +
-                df_expanded["COSTMATERIAL"] +
-                df_expanded["SURCHARGE_FIX"]
-            )
-            grouped = df_expanded.groupby(["NO_EOR", "IDKONTRAKTOR"]).agg(
-                MHRTOTAL=("MHR", "sum"),
-                HARGATOTAL=("HARGA_TOTAL", "sum")
-            ).reset_index()
-            df_pivot = grouped.pivot(
-                index="NO_EOR",
-                columns="IDKONTRAKTOR",
-                values=["MHRTOTAL", "HARGATOTAL"]
-            )
-            df_pivot.columns = [f"{val}_{col}" for val, col in df_pivot.columns]
+        # Hitung biaya semua vendor langsung dari baris input (tanpa tabel panjang baris x vendor)
+        if not df_for_calculation.empty:
+            df_pivot = self.sum_per_eor_vendor(df_for_calculation)
             all_results_df = all_results_df.join(df_pivot, how='left')
 
-        all_results_df = all_results_df.reset_index()
-        rename_map = {col: col.replace('HARGATOTAL_', 'PREDIKSI_').replace('MHRTOTAL_', 'MHR_') for col in all_results_df.columns}
-        final_df = all_results_df.rename(columns=rename_map)
-
-        # ...di dalam fungsi run_pipeline
-        for depo in final_df["DEPO"].unique():
-            for vendor in self.depo_config.get(depo, {}).get("vendors", []):
-                pred_col = f"PREDIKSI_{vendor}"
-                mhr_col = f"MHR_{vendor}"
-                if pred_col in final_df.columns and mhr_col in final_df.columns:
-                    # --- PERUBAHAN DI SINI ---
-                    # Gunakan np.where untuk menangani MHR nol secara aman
-                    ratio = np.where(
-                        final_df[mhr_col] > 0,              # Kondisi: jika MHR lebih dari 0
-                        final_df[pred_col] / final_df[mhr_col], # Lakukan pembagian jika benar
-                        np.nan                              # Jika tidak (MHR=0), hasilnya NaN
-                    )
-                    final_df[f"PREDIKSI/MHR_{vendor}"] = ratio
-                    # --- AKHIR PERUBAHAN ---
+        final_df = all_results_df.reset_index()
+        final_df.columns = (
+            final_df.columns
+            .str.replace('HARGATOTAL_', 'PREDIKSI_', regex=False)
+            .str.replace('MHRTOTAL_', 'MHR_', regex=False)
+        )
 
-        for idx, row in final_df.iterrows():
-            depo = row['DEPO']
-            grade = row['CONTAINER_GRADE']
-            for vendor in self.depo_config.get(depo, {}).get("vendors", []):
-                valid_grades = self.validity_map.get(depo, {}).get(vendor, [])
-                if grade not in valid_grades:
-                    for col_prefix in ["PREDIKSI_", "MHR_", "PREDIKSI/MHR_"]:
-                        col_name = f"{col_prefix}{vendor}"
-                        if col_name in final_df.columns:
-                            final_df.loc[idx, col_name] = np.nan
-                            
-        # Gabungkan warning count ke final_df
-        final_df = pd.merge(final_df, warning_counts, on='NO_EOR', how='left')
-        final_df['WARNING_COUNT'] = final_df['WARNING_COUNT'].fillna(0).astype(int)
+        # Rasio PREDIKSI/MHR untuk semua vendor sekaligus dalam satu blok 2D.
+        # MHR nol atau kosong menghasilkan NaN.
+        ratio_vendors = list(dict.fromkeys(
+            vendor
+            for depo in depos
+            for vendor in self.vendors_by_depo[depo]
+            if f"PREDIKSI_{vendor}" in final_df.columns and f"MHR_{vendor}" in final_df.columns
+        ))
+        if ratio_vendors:
+            num = final_df[[f"PREDIKSI_{v}" for v in ratio_vendors]].to_numpy(dtype=np.float64)
+            denom = final_df[[f"MHR_{v}" for v in ratio_vendors]].to_numpy(dtype=np.float64)
+            valid_denom = denom > 0
+            ratio = np.where(valid_denom, num / np.where(valid_denom, denom, 1), np.nan)
+            final_df[[f"PREDIKSI/MHR_{v}" for v in ratio_vendors]] = ratio
+
+        # Kosongkan hasil vendor yang tidak valid untuk grade kontainer,
+        # sekaligus per (depo, vendor) dengan mask vektor (tanpa iterrows)
+        depo_series = final_df['DEPO'].values
+        grade_series = final_df['CONTAINER_GRADE'].values
+        for depo in depos:
+            for vendor in self.vendors_by_depo[depo]:
+                valid_grades = self.validity_map[depo].get(vendor, [])
+                mask = (depo_series == depo) & ~np.isin(grade_series, np.asarray(valid_grades))
+                if not mask.any():
+                    continue
+                cols = [f"{col_prefix}{vendor}" for col_prefix in ["PREDIKSI_", "MHR_", "PREDIKSI/MHR_"]]
+                cols = [col for col in cols if col in final_df.columns]
+                if cols:
+                    final_df.loc[mask, cols] = np.nan
+
+        # Tambahkan warning count ke final_df (lookup per NO_EOR, tanpa merge)
+        final_df['WARNING_COUNT'] = final_df['NO_EOR'].map(warning_counts).fillna(0).astype('int16')
         
         return final_df
         
+# ==============================================================================
+# FUNGSI BANTU ALOKASI
+# ==============================================================================
+def first_fit_capacity_mask(mhr_needed: np.ndarray, container_cap, mhr_cap) -> np.ndarray:
+    """
+    Alokasi greedy first-fit sesuai urutan kandidat: kandidat diambil selama kapasitas
+    kontainer > 0 dan sisa kapasitas MHR >= MHR yang dibutuhkan; kandidat yang tidak muat
+    dilewati dan kandidat berikutnya tetap dicoba. Kapasitas tanpa batas = float('inf').
+
+    Satu pass berurutan dengan pengurangan sisa kapasitas per kandidat (sama seperti loop
+    aslinya, termasuk pembulatan float). Mengembalikan mask boolean.
+    """
+    mhr_values = np.asarray(mhr_needed, dtype=np.float64).tolist()
+    allocated = np.zeros(len(mhr_values), dtype=bool)
+    for i, mhr in enumerate(mhr_values):
+        if container_cap <= 0:
+            break
+        if mhr_cap >= mhr:
+            allocated[i] = True
+            container_cap -= 1
+            mhr_cap -= mhr
+    return allocated
+
+def other_vendors_with_column(columns, vendors, prefix):
+    """Vendor non-SPIL (sesuai urutan vendors) yang memiliki kolom <prefix><vendor> di hasil pipeline."""
+    return [v for v in vendors if v != 'SPIL' and f"{prefix}{v}" in columns]
+
+def row_nanmin(values: np.ndarray) -> np.ndarray:
+    """Minimum per baris dengan NaN diabaikan; baris tanpa nilai valid (atau tanpa kolom) = NaN."""
+    if values.shape[1] == 0:
+        return np.full(values.shape[0], np.nan)
+    # fmin.reduce mengabaikan NaN tanpa RuntimeWarning untuk baris yang semuanya NaN
+    return np.fmin.reduce(values, axis=1)
+
+def greedy_vendor_allocation(prices: np.ndarray, mhrs: np.ndarray, container_caps: np.ndarray, mhr_caps: np.ndarray) -> np.ndarray:
+    """
+    Alokasi greedy ke vendor lain. Untuk setiap baris (sesuai urutan kandidat), vendor dicoba
+    dari harga termurah (NaN = tidak valid) dan diambil vendor pertama yang kapasitas
+    kontainernya > 0 dan sisa MHR-nya cukup; kapasitas vendor itu lalu dikurangi.
+
+    prices dan mhrs berukuran (baris x vendor); container_caps dan mhr_caps berukuran (vendor,)
+    dan diubah in-place. Mengembalikan indeks vendor per baris, atau -1 jika tidak terhandle.
+    """
+    alloc_idx = np.full(prices.shape[0], -1, dtype=np.int64)
+    # Urutan vendor per baris dihitung sekali untuk seluruh matriks (NaN di akhir)
+    ranks = np.argsort(prices, axis=1, kind='stable')
+    for i in range(prices.shape[0]):
+        row_prices = prices[i]
+        for v in ranks[i]:
+            if np.isnan(row_prices[v]):
+                break  # NaN diurutkan paling akhir: tidak ada vendor valid lagi
+            if container_caps[v] > 0 and mhr_caps[v] >= mhrs[i, v]:
+                container_caps[v] -= 1
+                mhr_caps[v] -= mhrs[i, v]
+                alloc_idx[i] = v
+                break
+    return alloc_idx
+
 # ==============================================================================
 # UI STREAMLIT DAN LOGIKA APLIKASI
 # ==============================================================================
-@st.cache_data
+# Dtype teks berbasis Arrow: 'str' sudah didukung pyarrow di pandas >= 3
+TEXT_DTYPE = str if PANDAS_3 else 'string[pyarrow]'
+
+def strip_text(series):
+    # Strip spasi dengan kernel string Arrow; konversi dtype dilewati jika kolom sudah bertipe teks
+    if series.dtype == object or not pd.api.types.is_string_dtype(series.dtype):
+        series = series.astype(TEXT_DTYPE)
+    return series.str.strip()
+
+CSV_DELIMITERS = ',;\t'
+# Kolom wajib file upload bulk (urutan dipakai saat memilih kolom)
+BULK_REQUIRED_COLUMNS = ('NO_EOR', 'NOCONTAINER', 'MATERIAL', 'QTY')
+
+# Prefix kolom per vendor -> (label tampilan, format). Diurutkan dari prefix terpanjang
+# (paling spesifik) agar entri baru tidak bisa tertangkap prefix yang lebih pendek.
+VENDOR_COLUMN_PREFIXES = tuple(sorted(
+    [
+        ('PREDIKSI/MHR_', 'Biaya/MHR ', 'Rp {:,.0f}/jam'),
+        ('PREDIKSI_', 'Biaya ', 'Rp {:,.0f}'),
+        ('MHR_', 'MHR ', '{:,.2f}'),
+    ],
+    key=lambda spec: -len(spec[0])
+))
+# Alternatif regex mengikuti urutan di atas (terpanjang dulu) sehingga prefix spesifik menang
+VENDOR_PREFIX_PATTERN = re.compile('^(' + '|'.join(re.escape(prefix) for prefix, _, _ in VENDOR_COLUMN_PREFIXES) + ')')
+VENDOR_PREFIX_LABELS = {prefix: label for prefix, label, _ in VENDOR_COLUMN_PREFIXES}
+VENDOR_PREFIX_FORMATS = {prefix: fmt for prefix, _, fmt in VENDOR_COLUMN_PREFIXES}
+
+@lru_cache(maxsize=32)
+def build_comprehensive_maps(columns):
+    """
+    Peta rename dan format tabel alokasi lengkap untuk tuple kolom tertentu. Skema kolom
+    ditentukan pipeline (bukan input user), jadi hasilnya di-memo per tuple kolom.
+    Dict yang dikembalikan dipakai bersama antar rerun: jangan diubah di pemanggil.
+    """
+    rename_map = {
+        'HARGA_FINAL': 'Biaya Final', 'NO_EOR': 'No EOR', 'CONTAINER_TYPE': 'Tipe Kontainer',
+        'ALOKASI': 'Alokasi', 'Selisih_Prediksi_Biaya': 'Potensi Keuntungan (Total)',
+        'Selisih_Harga_per_MHR': 'Potensi Keuntungan (per MHR)', 'MHR': 'MHR Final',
+        'WARNING_COUNT': 'Jml Material Bermasalah',
+        'JUMLAH_MATERIAL': 'Total Material'
+    }
+    format_map = {
+        'Biaya Final': 'Rp {:,.0f}', 'MHR Final': '{:,.2f}',
+        'Potensi Keuntungan (Total)': 'Rp {:,.0f}', 'Potensi Keuntungan (per MHR)': 'Rp {:,.0f}/jam',
+        'Jml Material Bermasalah': '{:,.0f}',
+        'Total Material': '{:,.0f}'
+    }
+
+    # Kolom per vendor di-rename dengan satu regex di seluruh Index (bukan startswith per kolom)
+    column_index = pd.Index(columns)
+    matched_prefix = column_index.str.extract(VENDOR_PREFIX_PATTERN, expand=False)
+    is_vendor = matched_prefix.notna()
+    old_names = column_index[is_vendor]
+    new_names = old_names.str.replace(
+        VENDOR_PREFIX_PATTERN, lambda m: VENDOR_PREFIX_LABELS[m.group(1)], regex=True
+    )
+    rename_map.update(zip(old_names, new_names))
+    format_map.update(zip(new_names, matched_prefix[is_vendor].map(VENDOR_PREFIX_FORMATS)))
+    return rename_map, format_map
+
+def strip_column_name(col):
+    # Header dari Excel bisa berupa angka; hanya header teks yang di-strip
+    return col.strip() if isinstance(col, str) else col
+
+def read_csv_sniffed(content_str):
+    # Deteksi delimiter sekali dari potongan awal file, lalu parse dengan engine C
+    try:
+        delimiter = csv.Sniffer().sniff(content_str[:8192], delimiters=CSV_DELIMITERS).delimiter
+    except csv.Error:
+        delimiter = ','
+    return pd.read_csv(StringIO(content_str), sep=delimiter)
+
+# Di atas jumlah baris ini CSV Arrow ditulis paralel per potongan baris
+CSV_PARALLEL_MIN_ROWS = 200_000
+
+def arrow_table_to_csv_bytes(table, include_header=True):
+    sink = pa.BufferOutputStream()
+    pa_csv.write_csv(table, sink, pa_csv.WriteOptions(include_header=include_header))
+    return sink.getvalue().to_pybytes()
+
+def dataframe_to_csv_bytes(df):
+    # Serialisasi CSV untuk tombol download lewat writer C++ Arrow jika tersedia
+    if pa_csv is not None:
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            workers = min(os.cpu_count() or 1, 8)
+            if workers == 1 or table.num_rows < CSV_PARALLEL_MIN_ROWS:
+                return arrow_table_to_csv_bytes(table)
+            # Writer Arrow melepas GIL: potongan baris (slice zero-copy) di-encode di thread
+            # terpisah lalu digabung; header hanya ditulis di potongan pertama
+            step = -(-table.num_rows // workers)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                parts = executor.map(
+                    lambda start: arrow_table_to_csv_bytes(table.slice(start, step), include_header=start == 0),
+                    range(0, table.num_rows, step)
+                )
+                return b''.join(parts)
+        except (pa.ArrowException, TypeError, ValueError):
+            pass  # mis. kolom object campuran yang tidak bisa dikonversi Arrow: pakai writer pandas
+    # Writer pandas menulis UTF-8 langsung ke buffer biner (tanpa str perantara + encode)
+    buffer = BytesIO()
+    df.to_csv(buffer, index=False, encoding='utf-8')
+    return buffer.getvalue()
+
+# Format file download hasil -> (ekstensi, MIME). Parquet/Feather butuh pyarrow.
+DOWNLOAD_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+    "Feather": ("feather", "application/vnd.apache.arrow.file"),
+}
+
+def dataframe_to_download_bytes(df, download_format):
+    # Parquet/Feather: kolumnar + zstd, tipe data kolom ikut tersimpan sehingga cepat dibaca ulang
+    if download_format == "Parquet":
+        buffer = BytesIO()
+        df.to_parquet(buffer, engine='pyarrow', compression='zstd', index=False)
+        return buffer.getvalue()
+    if download_format == "Feather":
+        buffer = BytesIO()
+        pa_feather.write_feather(pa.Table.from_pandas(df, preserve_index=False), buffer, compression='zstd')
+        return buffer.getvalue()
+    return dataframe_to_csv_bytes(df)
+
+def dataframe_content_key(df):
+    """
+    Kunci cache dari seluruh isi tabel. Hash bawaan st.cache_data hanya mengambil sampel
+    baris untuk tabel besar, jadi tabel hasil memakai kunci ini (argumen _df tidak di-hash).
+    Digest atas urutan hash baris (bukan jumlahnya) agar tabel yang sama dengan urutan
+    baris berbeda tidak berbagi kunci; dtype ikut kunci karena memengaruhi isi file.
+    """
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return (
+        tuple(df.columns), tuple(map(str, df.dtypes)),
+        hashlib.blake2b(row_hashes.tobytes(), digest_size=16).hexdigest()
+    )
+
+@st.cache_data(max_entries=8)
+def cached_download_bytes(_df, content_key, download_format):
+    # _df tidak di-hash Streamlit; identitas isi tabel diwakili content_key
+    return dataframe_to_download_bytes(_df, download_format)
+
+def download_bytes(df, download_format):
+    """
+    Data tombol download (dipanggil saat diklik). Sidik jari isi tabel (hash per baris,
+    satu pass vektor) jauh lebih murah daripada serialisasi ulang, jadi klik berikutnya
+    untuk tabel dan format yang sama memakai bytes yang sudah ada.
+    """
+    return cached_download_bytes(df, dataframe_content_key(df), download_format)
+
+def read_excel_upload(content, file_extension):
+    # calamine (Rust) membaca xlsx/xls/ods sekaligus; tanpa calamine pakai openpyxl/odf
+    if EXCEL_ENGINE is not None:
+        return pd.read_excel(BytesIO(content), engine=EXCEL_ENGINE)
+    return pd.read_excel(BytesIO(content), engine='odf' if file_extension == 'ods' else None)
+
+@st.cache_resource
+def get_gspread_client():
+    # Otorisasi service account cukup sekali per proses; dipakai ulang setiap reload master
+    scope = ["https://spreadsheets.google.com/feeds",'https://www.googleapis.com/auth/drive']
+    # IMPORTANT: Replace "daring-span-436113-t5-9d44f9437abd.json" with the actual name of your JSON keyfile.
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(
+        st.secrets["google_service_account"], scope
+    )
+    return gspread.authorize(creds)
+
+def get_master_version(master_material_df):
+    """Sidik jari isi master; berubah setiap kali data master dari Google Sheet berubah."""
+    if master_material_df is None:
+        return None
+    return int(pd.util.hash_pandas_object(master_material_df, index=False).sum())
+
+@st.cache_data(ttl=900)
 def load_master_data():
     try:
-        scope = ["https://spreadsheets.google.com/feeds",'https://www.googleapis.com/auth/drive']
-        # IMPORTANT: Replace "daring-span-436113-t5-9d44f9437abd.json" with the actual name of your JSON keyfile.
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(
-            st.secrets["google_service_account"], scope
-        )
-    
-        client = gspread.authorize(creds)
+        client = get_gspread_client()
 
         # Replace with your Spreadsheet ID
         spreadsheet_id = "1llPtY1eX2j3tf8yaUGKc56M4EnbjPGpGf5ATVvN1_OQ"
         sheet = client.open_by_key(spreadsheet_id).sheet1
 
-        data = sheet.get_all_records()
-        df = pd.DataFrame(data)
+        # get_all_values mengembalikan list of lists (tanpa dict per baris);
+        # baris pertama adalah header. Kolom numerik di-coerce di kalkulator.
+        values = sheet.get_all_values()
+        df = pd.DataFrame(values[1:], columns=[str(c).strip() for c in values[0]])
         # --- PERBAIKAN ---
         # Membersihkan spasi ekstra dari kolom MATERIAL untuk memastikan pencocokan yang akurat
         if 'MATERIAL' in df.columns:
-            df['MATERIAL'] = df['MATERIAL'].astype(str).str.strip()
-        return df
+            df['MATERIAL'] = strip_text(df['MATERIAL'])
+        # Daftar pilihan material dan versi master ikut di-cache bersama master,
+        # sehingga hashing isi master hanya terjadi saat master dimuat ulang (bukan setiap rerun)
+        material_options = tuple(["- Pilih Material -"] + sorted(df["MATERIAL"].dropna().unique().tolist()))
+        return df, material_options, get_master_version(df)
     
     except Exception as e:
         st.error(f"Terjadi error saat mengambil master material: {e}")
-        return None
+        return None, (), None
 
 
-@st.cache_resource
-def get_pipeline(_master_material_df):
-    """Membuat instance kalkulator deterministik dan menyimpannya di cache."""
+@st.cache_resource(max_entries=2)
+def get_pipeline(_master_material_df, master_version):
+    """
+    Membuat instance kalkulator deterministik dan menyimpannya di cache.
+    Cache dikunci dengan master_version agar kalkulator dibangun ulang saat master diperbarui
+    (mis. lewat tombol Refresh), dan dipakai ulang di setiap rerun selama master tetap sama.
+    """
     if _master_material_df is None:
         return None
     pipeline = DeterministicCostCalculator(master_material_df=_master_material_df)
     return pipeline
 
+@st.cache_data
+def make_template_bytes():
+    """Template Excel upload bulk; isinya konstan sehingga cukup dibuat sekali."""
+    template_data = {
+        'NO_EOR': [
+            'EOR/00000004/01/2023',
+            'EOR/00000004/01/2023',
+            'EOR/00000004/01/2023',
+            'EOR/00000005/01/2023',
+            'EOR/00000005/01/2023',
+            'EOR/00000005/01/2023'
+        ],
+        'NOCONTAINER': [
+            'SPNU2839051',
+            'SPNU2839051',
+            'SPNU2839051',
+            'SPNU2759465',
+            'SPNU2759465',
+            'SPNU2759465'
+        ],
+        'MATERIAL': [ # Mengganti KETERANGAN dengan MATERIAL
+            'MISCELENEOUS - SECURING DEVICE / OTHER MATERIAL REMOVE',
+            'CROSS MEMBER - INSERT 30 CM',
+            'FORKLIFT POCKET - WEB STRAIGHTEN',
+            'SIDE PANEL - STRAIGHTEN AND WELD 30 CM',
+            'ROOF PANEL STRAIGHTEN AND WELD 30 CM',
+            'SIDE PANEL - STRAIGHTEN 30 X 90 CM'
+        ],
+        'QTY': [1, 1, 2, 1, 1, 1]
+    }
+    template_df = pd.DataFrame(template_data)
+    excel_buffer = BytesIO()
+    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
+        template_df.to_excel(writer, index=False, sheet_name='Template')
+    return excel_buffer.getvalue()
+
+# Di atas jumlah baris ini Styler (format per sel) terlalu berat: kolom diformat jadi teks sekali jalan
+STYLER_MAX_ROWS = 2000
+
+def format_result_table(df, format_map, na_rep='-'):
+    """
+    Format angka tabel hasil untuk st.dataframe. Tabel kecil memakai Styler (nilai asli tetap
+    numerik sehingga sort di UI benar); tabel besar diformat per kolom menjadi string.
+    """
+    if len(df) <= STYLER_MAX_ROWS:
+        # Kolom dikelompokkan per string format: satu format(subset=...) per kelompok
+        columns_by_format = {}
+        for col, fmt in format_map.items():
+            if col in df.columns:
+                columns_by_format.setdefault(fmt, []).append(col)
+        styler = df.style
+        for fmt, cols in columns_by_format.items():
+            styler = styler.format(fmt, subset=cols, na_rep=na_rep)
+        return styler
+    formatted = {}
+    for col, fmt in format_map.items():
+        if col not in df.columns:
+            continue
+        values = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        valid = ~np.isnan(values)
+        out = np.full(len(values), na_rep, dtype=object)
+        out[valid] = [fmt.format(v) for v in values[valid].tolist()]
+        formatted[col] = out
+    return df.assign(**formatted)
+
+# Tabel hasil di layar dibatasi ke baris teratas; file download tetap berisi semua baris
+DISPLAY_MAX_ROWS = 5000
+
+def show_result_table(sorted_df, format_map, download_format="CSV"):
+    # sorted_df sudah terurut menurun, jadi head() = top-K tanpa sort ulang
+    top_view = sorted_df.head(DISPLAY_MAX_ROWS)
+    if len(sorted_df) > DISPLAY_MAX_ROWS:
+        st.caption(f"Menampilkan {DISPLAY_MAX_ROWS:,} baris teratas dari {len(sorted_df):,}. Download {download_format} untuk data lengkap.")
+    st.dataframe(format_result_table(top_view, format_map), height=600, width="stretch")
+
+@st.cache_data(max_entries=16)
+def prepare_display_table(_df, content_key, rename_map, sort_candidates):
+    """
+    Rename dan urutkan menurun tabel hasil untuk tampilan dan download.
+    Diurutkan menurut kolom pertama di sort_candidates yang tersedia setelah rename.
+    Di-cache per content_key (dataframe_content_key) sehingga rerun dengan hasil yang sama
+    tidak mengulang sort, sedangkan perubahan satu baris pun menghasilkan entri baru.
+    """
+    display_df = _df.rename(columns=rename_map)
+    if pa is not None:
+        # Kolom float dan teks menjadi dtype Arrow (serialisasi ke st.dataframe/Parquet/Feather
+        # tanpa konversi buffer NumPy). convert_integer=False agar kolom float tetap float
+        # (format '{:,.2f}' dsb. tidak berubah); kolom integer dan kategori tetap berbasis NumPy.
+        display_df = display_df.convert_dtypes(dtype_backend='pyarrow', convert_integer=False)
+    sort_column = next((col for col in sort_candidates if col in display_df.columns), None)
+    if sort_column is not None:
+        sort_series = display_df[sort_column]
+        if pd.api.types.is_numeric_dtype(sort_series.dtype):
+            # argsort langsung di ndarray; negasi membuat urutan menurun dengan NaN tetap di akhir
+            order = np.argsort(-sort_series.to_numpy(dtype=np.float64, na_value=np.nan), kind='stable')
+            display_df = display_df.take(order)
+        else:
+            display_df = display_df.sort_values(by=sort_column, ascending=False)
+    return display_df
+
 st.set_page_config(page_title="Container Repair Allocation", layout="wide")
 st.title("Dashboard Alokasi Perbaikan Kontainer")
 
-master_material_df = load_master_data()
-pipeline = get_pipeline(master_material_df)
+master_material_df, MATERIAL_OPTIONS, MASTER_VERSION = load_master_data()
+pipeline = get_pipeline(master_material_df, MASTER_VERSION)
 
 if pipeline:
     with st.sidebar:
@@ -256,33 +655,34 @@ if pipeline:
         st.header("Estimasi Biaya Perbaikan")
         st.info("Masukkan detail perbaikan untuk satu kontainer untuk melihat perbandingan biaya antar vendor.")
         num_entries = st.number_input("Jumlah Item Kerusakan", min_value=1, max_value=30, value=3, help="Tentukan berapa banyak baris kerusakan yang akan Anda masukkan.", key="manual_num_entries")
-        MATERIAL_OPTIONS = ["- Pilih Material -"] + sorted(master_material_df["MATERIAL"].dropna().unique().tolist())
         
         with st.form("manual_entry_form"):
             container_grade = st.selectbox("Kontainer Grade", ['A', 'B', 'C'], key="manual_grade")
             container_size = st.selectbox("Ukuran Kontainer", ['20', '40'], key="manual_size")
-            damage_data = {'material': [], 'qty': []}
-            cols_header = st.columns(2)
-            cols_header[0].markdown("**Material**")
-            cols_header[1].markdown("**Kuantitas**")
-            for i in range(num_entries):
-                cols = st.columns(2)
-                damage_data['material'].append(cols[0].selectbox(f"Material_{i}", MATERIAL_OPTIONS, key=f"material_{i}", label_visibility="collapsed"))
-                damage_data['qty'].append(cols[1].number_input(f"Qty_{i}", min_value=1, value=1, key=f"qty_{i}", label_visibility="collapsed"))
+            # Satu data_editor untuk seluruh baris kerusakan (bukan sepasang widget per baris)
+            edit_df = pd.DataFrame({'MATERIAL': [MATERIAL_OPTIONS[0]] * num_entries, 'QTY': [1] * num_entries})
+            damage_df = st.data_editor(
+                edit_df,
+                column_config={
+                    'MATERIAL': st.column_config.SelectboxColumn("Material", options=MATERIAL_OPTIONS, required=True),
+                    'QTY': st.column_config.NumberColumn("Kuantitas", min_value=1, step=1, default=1, required=True)
+                },
+                num_rows="dynamic", hide_index=True, key="manual_editor"
+            )
             submitted = st.form_submit_button("Cek Estimasi")
         if submitted:
-            if any(opt.startswith("- Pilih") for opt in damage_data['material']):
+            materials = damage_df['MATERIAL']
+            if damage_df.empty or materials.isna().any() or materials.astype(str).str.startswith("- Pilih").any() or damage_df['QTY'].isna().any():
                 st.warning("Mohon pastikan semua item Material telah dipilih.")
             else:
                 with st.spinner("Menghitung biaya..."):
-                    manual_input_rows = []
-                    for i in range(num_entries):
-                        manual_input_rows.append({
-                            "NO_EOR": "MANUAL_CHECK", "CONTAINER_SIZE": container_size, "CONTAINER_GRADE": container_grade,
-                            "CONTAINER_TYPE": str(container_size) + str(container_grade), "MATERIAL": damage_data['material'][i],
-                            "QTY": damage_data['qty'][i], "DEPO": depo_option
-                        })
-                    manual_df = pd.DataFrame(manual_input_rows)
+                    # Kolom dibangun langsung sebagai array (nilai konstan cukup skalar, di-broadcast pandas)
+                    manual_df = pd.DataFrame({
+                        "NO_EOR": "MANUAL_CHECK", "CONTAINER_SIZE": container_size, "CONTAINER_GRADE": container_grade,
+                        "CONTAINER_TYPE": str(container_size) + str(container_grade),
+                        "MATERIAL": damage_df['MATERIAL'].to_numpy(), "QTY": damage_df['QTY'].to_numpy(),
+                        "DEPO": depo_option
+                    })
                     try:
                         # Opsi default untuk pengecekan manual
                         prediction_result = pipeline.run_pipeline(manual_df, "Hitung semua material (nilai kosong = 0)")
@@ -295,7 +695,7 @@ if pipeline:
                                 st.warning(f"⚠️ Ada {result_row['WARNING_COUNT']} material yang tidak ditemukan di data master dan tidak dihitung dalam estimasi.")
                             
                             display_data_list = []
-                            for vendor in pipeline.depo_config.get(depo_option, {}).get("vendors", []):
+                            for vendor in pipeline.vendors_by_depo.get(depo_option, []):
                                 display_data_list.append({
                                     "Vendor": vendor,
                                     "Prediksi Biaya": result_row.get(f"PREDIKSI_{vendor}", np.nan),
@@ -320,43 +720,9 @@ if pipeline:
         st.header("Alokasi Optimal untuk Perbaikan Kontainer")
         st.info("Pastikan file CSV, Excel, atau ODS yang diupload memiliki kolom: `NO_EOR`, `NOCONTAINER` , `MATERIAL`, `QTY`.")
         
-        template_data = {
-            'NO_EOR': [
-                'EOR/00000004/01/2023',
-                'EOR/00000004/01/2023',
-                'EOR/00000004/01/2023',
-                'EOR/00000005/01/2023',
-                'EOR/00000005/01/2023',
-                'EOR/00000005/01/2023'
-            ],
-            'NOCONTAINER': [
-                'SPNU2839051',
-                'SPNU2839051',
-                'SPNU2839051',
-                'SPNU2759465',
-                'SPNU2759465',
-                'SPNU2759465'
-            ],
-            'MATERIAL': [ # Mengganti KETERANGAN dengan MATERIAL
-                'MISCELENEOUS - SECURING DEVICE / OTHER MATERIAL REMOVE',
-                'CROSS MEMBER - INSERT 30 CM',
-                'FORKLIFT POCKET - WEB STRAIGHTEN',
-                'SIDE PANEL - STRAIGHTEN AND WELD 30 CM',
-                'ROOF PANEL STRAIGHTEN AND WELD 30 CM',
-                'SIDE PANEL - STRAIGHTEN 30 X 90 CM'
-            ],
-            'QTY': [1, 1, 2, 1, 1, 1]
-        }
-        template_df = pd.DataFrame(template_data)
-        
-        # Buat template Excel
-        excel_buffer = BytesIO()
-        with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-            template_df.to_excel(writer, index=False, sheet_name='Template')
-        
         st.download_button(
             label="Download Template Excel",
-            data=excel_buffer.getvalue(),
+            data=make_template_bytes(),
             file_name="template_alokasi_perbaikan.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             help="Download template Excel dengan format yang benar"
@@ -410,7 +776,7 @@ if pipeline:
         use_other_vendors = st.checkbox("Alokasikan sisa pekerjaan ke Vendor Lain", key="use_other_vendors", value=True)
         other_vendor_capacities_input = {}
         if use_other_vendors:
-            other_vendors = [v for v in pipeline.depo_config.get(depo_option, {}).get("vendors", []) if v != 'SPIL']
+            other_vendors = [v for v in pipeline.vendors_by_depo.get(depo_option, []) if v != 'SPIL']
             if other_vendors:
                 st.markdown("**Kapasitas Vendor Lain**")
                 for vendor in other_vendors:
@@ -423,58 +789,54 @@ if pipeline:
 
 
         st.markdown("---")
+        download_format_options = list(DOWNLOAD_FORMATS) if pa is not None else ["CSV"]
+        download_format = st.radio(
+            "Format File Download", download_format_options, horizontal=True, key="download_format",
+            help="Parquet/Feather menyimpan tipe data kolom dan lebih cepat dibaca ulang (mis. dengan pandas); CSV paling kompatibel."
+        )
+        download_ext, download_mime = DOWNLOAD_FORMATS[download_format]
         run_bulk_button = st.button("Cek Alokasi", type="primary", key="spil_run")
         
-        @st.cache_data
+        @st.cache_data(max_entries=8)
         # --- PERUBAHAN FITUR: Menambahkan parameter priority_types (list) ---
-        def run_spil_centric_allocation(_pipeline, uploaded_file_content, file_name, depo_option, allocation_method, priority_types, spil_today_cap, other_vendor_caps, use_ov, use_container_filter, use_mhr_filter, calculation_option):
+        def prepare_bulk_results(_pipeline, master_version, uploaded_file_content, file_name, depo_option, priority_types, calculation_option):
+            # Tahap berat (baca file + pipeline) di-cache terpisah dari alokasi,
+            # sehingga perubahan kapasitas/metode tidak menjalankan ulang pipeline
             try:
                 file_extension = file_name.split('.')[-1].lower()
                 
                 # Membaca file berdasarkan ekstensinya
                 if file_extension == 'csv':
-                    content_str = uploaded_file_content.decode('utf-8')
-                    # Coba baca dengan beberapa delimiter umum
-                    for delimiter in [',', ';', '\t']:
-                        try:
-                            data_raw = pd.read_csv(StringIO(content_str), delimiter=delimiter)
-                            break
-                        except Exception:
-                            continue
-                    if 'data_raw' not in locals():
-                        data_raw = pd.read_csv(StringIO(content_str), engine='python')
-                elif file_extension in ['xlsx', 'xls']:
-                    data_raw = pd.read_excel(BytesIO(uploaded_file_content))
-                elif file_extension == 'ods':
-                    data_raw = pd.read_excel(BytesIO(uploaded_file_content), engine='odf')
+                    data_raw = read_csv_sniffed(uploaded_file_content.decode('utf-8'))
+                elif file_extension in ['xlsx', 'xls', 'ods']:
+                    data_raw = read_excel_upload(uploaded_file_content, file_extension)
                 else:
                     st.error(f"Format file tidak didukung: {file_extension}")
-                    return pd.DataFrame(), pd.DataFrame() # Return two empty dataframes
+                    return pd.DataFrame()
 
-                data_raw.columns = data_raw.columns.str.strip()
+                data_raw = data_raw.rename(columns=strip_column_name)
                 
                 if 'MATERIAL' in data_raw.columns:
-                    data_raw['MATERIAL'] = data_raw['MATERIAL'].astype(str).str.strip()
+                    data_raw['MATERIAL'] = strip_text(data_raw['MATERIAL'])
 
-                list_need = ['NO_EOR', 'NOCONTAINER', 'MATERIAL', 'QTY']
-                missing_cols = [col for col in list_need if col not in data_raw.columns]
+                missing_cols = [col for col in BULK_REQUIRED_COLUMNS if col not in data_raw.columns]
                 if missing_cols:
                     st.error(f"Kolom berikut tidak ditemukan: {', '.join(missing_cols)}")
                     return pd.DataFrame()
                 
-                data = data_raw[list_need].copy()
-                data[['CONTAINER_SIZE', 'CONTAINER_GRADE']] = data['NOCONTAINER'].apply(
-                    lambda x: pd.Series(get_container_size_grade(x))
-                )
-                data['CONTAINER_TYPE'] = data['CONTAINER_SIZE'] + data['CONTAINER_GRADE']
+                data = data_raw[list(BULK_REQUIRED_COLUMNS)]
+                data['CONTAINER_SIZE'], data['CONTAINER_GRADE'] = get_container_size_grade_series(data['NOCONTAINER'])
+                data['CONTAINER_TYPE'] = data['CONTAINER_SIZE'].str.cat(data['CONTAINER_GRADE'])
                 data["DEPO"] = depo_option
+                # MATERIAL berulang di banyak baris: kategori mempercepat join/isin di pipeline
+                data['MATERIAL'] = data['MATERIAL'].astype('category')
 
                 # --- PERUBAHAN FITUR: Logika pemfilteran berdasarkan prioritas (Multi-select) ---
                 if priority_types: # Cek apakah list tidak kosong
                     initial_rows = len(data)
                     # Filter EOR yang memiliki setidaknya satu baris dengan CONTAINER_TYPE yang dipilih
                     eors_to_keep = data[data['CONTAINER_TYPE'].isin(priority_types)]['NO_EOR'].unique()
-                    data = data[data['NO_EOR'].isin(eors_to_keep)].copy()
+                    data = data[data['NO_EOR'].isin(eors_to_keep)]
                     
                     selected_priorities_str = ", ".join(priority_types)
                     if data.empty:
@@ -493,6 +855,8 @@ if pipeline:
                 # --- PENAMBAHAN FITUR: GABUNGKAN JUMLAH MATERIAL KE HASIL ---
                 raw_results = pd.merge(raw_results, material_counts, on='NO_EOR', how='left')
                 # --- AKHIR PENAMBAHAN FITUR ---
+                raw_results['NO_EOR'] = raw_results['NO_EOR'].astype('category')
+                raw_results['CONTAINER_TYPE'] = raw_results['CONTAINER_TYPE'].astype('category')
 
                 if 'PREDIKSI_SPIL' not in raw_results.columns:
                     st.error("Perhitungan untuk SPIL tidak tersedia.")
@@ -501,107 +865,103 @@ if pipeline:
                 if 'WARNING_COUNT' not in raw_results.columns:
                     raw_results['WARNING_COUNT'] = 0
 
-                other_vendor_preds = [c for c in raw_results.columns if c.startswith('PREDIKSI_') and 'SPIL' not in c and not c.startswith('PREDIKSI/MHR_')]
-                raw_results['Prediksi_Biaya_Lain'] = raw_results[other_vendor_preds].min(axis=1)
-                raw_results['Selisih_Prediksi_Biaya'] = raw_results['Prediksi_Biaya_Lain'] - raw_results['PREDIKSI_SPIL']
+                # Kolom vendor lain dibangun dari daftar vendor depo, urutannya sama dengan kolom pipeline:
+                # PREDIKSI_* alfabetis, PREDIKSI/MHR_* mengikuti depo_config
+                depo_vendors = _pipeline.vendors_by_depo.get(depo_option, [])
+                other_vendor_preds = [f'PREDIKSI_{v}' for v in other_vendors_with_column(raw_results.columns, sorted(depo_vendors), 'PREDIKSI_')]
+                prediksi_lain = row_nanmin(raw_results[other_vendor_preds].to_numpy())
+                raw_results['Prediksi_Biaya_Lain'] = prediksi_lain
+                raw_results['Selisih_Prediksi_Biaya'] = prediksi_lain - raw_results['PREDIKSI_SPIL'].to_numpy()
                 
-                other_vendor_mhr_ratio = [c for c in raw_results.columns if c.startswith('PREDIKSI/MHR_') and 'SPIL' not in c]
-                raw_results['HargaPerMHR_Lain'] = raw_results[other_vendor_mhr_ratio].min(axis=1)
-                raw_results['Selisih_Harga_per_MHR'] = raw_results['HargaPerMHR_Lain'] - raw_results['PREDIKSI/MHR_SPIL']
+                other_vendor_mhr_ratio = [f'PREDIKSI/MHR_{v}' for v in other_vendors_with_column(raw_results.columns, depo_vendors, 'PREDIKSI/MHR_')]
+                harga_per_mhr_lain = row_nanmin(raw_results[other_vendor_mhr_ratio].to_numpy())
+                raw_results['HargaPerMHR_Lain'] = harga_per_mhr_lain
+                raw_results['Selisih_Harga_per_MHR'] = harga_per_mhr_lain - raw_results['PREDIKSI/MHR_SPIL'].to_numpy()
+
+                return raw_results
+            except Exception as e:
+                st.error(f"Terjadi kesalahan saat memproses file: {e}")
+                st.exception(e)
+                return pd.DataFrame()
+
+        def run_spil_centric_allocation(raw_results, depo_vendors, allocation_method, spil_today_cap, other_vendor_caps, use_ov, use_container_filter, use_mhr_filter):
+            try:
+                if raw_results.empty:
+                    return raw_results
 
                 if allocation_method == 'Prediksi Harga per MHR':
                     sort_key = 'Selisih_Harga_per_MHR'
                 else:
                     sort_key = 'Selisih_Prediksi_Biaya'
                 
-                spil_candidates = raw_results.sort_values(by=sort_key, ascending=False)
-                allocations = {}
+                # Urutan kandidat SPIL disimpan sebagai posisi baris raw_results (tanpa menyalin tabel)
+                spil_order = raw_results.index.get_indexer(raw_results[sort_key].sort_values(ascending=False).index)
                 spil_container_cap = spil_today_cap['kontainer'] if use_container_filter else float('inf')
                 spil_mhr_cap = spil_today_cap['mhr'] if use_mhr_filter else float('inf')
-                unallocated_eors = []
-                
-                for idx, row in spil_candidates.iterrows():
-                    eor = row['NO_EOR']
-                    mhr_needed = row.get('MHR_SPIL', 0)
-                    if pd.isna(mhr_needed): mhr_needed = 0
-                    if (not use_container_filter or spil_container_cap > 0) and (not use_mhr_filter or spil_mhr_cap >= mhr_needed):
-                        if allocation_method == 'Prediksi Harga per MHR':
-                            harga_final_value = row['PREDIKSI/MHR_SPIL']
-                        else:
-                            harga_final_value = row['PREDIKSI_SPIL']
-                        
-                        # --- PERUBAHAN DI SINI ---
-                        allocations[eor] = {
-                            'ALOKASI': 'SPIL', 
-                            'HARGA_FINAL': harga_final_value,
-                            'BIAYA_TOTAL_ALOKASI': row['PREDIKSI_SPIL'] # Selalu simpan biaya total aktual
-                        }
-                        # --- AKHIR PERUBAHAN ---
 
-                        if use_container_filter: spil_container_cap -= 1
-                        if use_mhr_filter: spil_mhr_cap -= mhr_needed
-                    else:
-                        unallocated_eors.append(eor)
-                
-                overflow_df = spil_candidates[spil_candidates['NO_EOR'].isin(unallocated_eors)].copy()
+                # Alokasi SPIL: mask kandidat yang masuk kapasitas hari ini
+                spil_mask = first_fit_capacity_mask(
+                    raw_results['MHR_SPIL'].fillna(0).to_numpy()[spil_order], spil_container_cap, spil_mhr_cap
+                )
+                harga_final_col = 'PREDIKSI/MHR_SPIL' if allocation_method == 'Prediksi Harga per MHR' else 'PREDIKSI_SPIL'
+
+                # Hasil alokasi ditulis langsung ke array sepanjang raw_results (default: Tidak Terhandle)
+                n_rows = len(raw_results)
+                alokasi = np.full(n_rows, 'Tidak Terhandle', dtype=object)
+                harga_final = np.full(n_rows, np.nan)
+                biaya_total_alokasi = np.full(n_rows, np.nan)
+
+                spil_pos = spil_order[spil_mask]
+                alokasi[spil_pos] = 'SPIL'
+                harga_final[spil_pos] = raw_results[harga_final_col].to_numpy(dtype=np.float64)[spil_pos]
+                biaya_total_alokasi[spil_pos] = raw_results['PREDIKSI_SPIL'].to_numpy(dtype=np.float64)[spil_pos] # Selalu simpan biaya total aktual
+                # NO_EOR unik per baris: sisa kandidat = posisi yang tidak masuk SPIL (urutan sort_key tetap)
+                overflow_pos = spil_order[~spil_mask]
                 
                 if use_ov:
-                    other_vendor_candidates = overflow_df.sort_values(by=sort_key, ascending=True) # Ascending to pick the cheapest other vendor
-                    for idx, row in other_vendor_candidates.iterrows():
-                        eor = row['NO_EOR']
-                        allocated = False
-                        
-                        # Determine sort order for cheapest options based on allocation method
-                        if allocation_method == 'Prediksi Harga per MHR':
-                            pred_cols_other = [c for c in raw_results.columns if c.startswith('PREDIKSI/MHR_') and 'SPIL' not in c]
-                            cheapest_options = row[pred_cols_other].dropna().sort_values()
-                        else:
-                            cheapest_options = row[other_vendor_preds].dropna().sort_values()
+                    # Ascending to pick the cheapest other vendor: overflow_pos sudah urut menurun (NaN di akhir),
+                    # jadi bagian non-NaN cukup dibalik tanpa sort ulang
+                    key_isna = np.isnan(raw_results[sort_key].to_numpy(dtype=np.float64)[overflow_pos])
+                    candidate_pos = np.concatenate([overflow_pos[~key_isna][::-1], overflow_pos[key_isna]])
 
-                        for vendor_price_val in cheapest_options.items():
-                            if allocation_method == 'Prediksi Harga per MHR':
-                                vendor_name = vendor_price_val[0].replace('PREDIKSI/MHR_', '')
-                            else:
-                                vendor_name = vendor_price_val[0].replace('PREDIKSI_', '')
-
-                            mhr_needed = row.get(f'MHR_{vendor_name}', 0)
-                            if pd.isna(mhr_needed): mhr_needed = 0
-                            
-                            container_cap = other_vendor_caps.get(vendor_name, {}).get('kontainer', 0) if use_container_filter else float('inf')
-                            mhr_cap = other_vendor_caps.get(vendor_name, {}).get('mhr', 0) if use_mhr_filter else float('inf')
-                            
-                            if (not use_container_filter or container_cap > 0) and (not use_mhr_filter or mhr_cap >= mhr_needed):
-                                # --- PERUBAHAN DI SINI ---
-                                allocations[eor] = {
-                                    'ALOKASI': f'{vendor_name}', 
-                                    'HARGA_FINAL': vendor_price_val[1],
-                                    'BIAYA_TOTAL_ALOKASI': row[f'PREDIKSI_{vendor_name}'] # Selalu simpan biaya total aktual
-                                }
-                                # --- AKHIR PERUBAHAN ---
-                                if use_container_filter: other_vendor_caps[vendor_name]['kontainer'] -= 1
-                                if use_mhr_filter: other_vendor_caps[vendor_name]['mhr'] -= mhr_needed
-                                allocated = True
-                                break # Move to next EOR once allocated
-                        if not allocated:
-                            # --- PERUBAHAN DI SINI ---
-                            allocations[eor] = {
-                                'ALOKASI': 'Tidak Terhandle', 
-                                'HARGA_FINAL': np.nan,
-                                'BIAYA_TOTAL_ALOKASI': np.nan
-                            }
-                            # --- AKHIR PERUBAHAN ---
-                else: # If not using other vendors
-                    for eor in overflow_df['NO_EOR']:
-                        # --- PERUBAHAN DI SINI ---
-                        allocations[eor] = {
-                            'ALOKASI': 'Tidak Terhandle', 
-                            'HARGA_FINAL': np.nan,
-                            'BIAYA_TOTAL_ALOKASI': np.nan
-                        }
-                        # --- AKHIR PERUBAHAN ---
-
-                allocations_df = pd.DataFrame.from_dict(allocations, orient='index')
-                final_df = raw_results.set_index('NO_EOR').join(allocations_df, how='left').reset_index()
+                    # Kolom harga pembanding sesuai metode alokasi; urutan kolom menentukan urutan vendor saat harga sama
+                    if allocation_method == 'Prediksi Harga per MHR':
+                        vendor_names = other_vendors_with_column(raw_results.columns, depo_vendors, 'PREDIKSI/MHR_')
+                        price_cols_other = [f'PREDIKSI/MHR_{v}' for v in vendor_names]
+                    else:
+                        vendor_names = other_vendors_with_column(raw_results.columns, sorted(depo_vendors), 'PREDIKSI_')
+                        price_cols_other = [f'PREDIKSI_{v}' for v in vendor_names]
+
+                    # Hanya kolom yang dibaca alokasi yang diambil, langsung sebagai ndarray
+                    prices = raw_results[price_cols_other].to_numpy(dtype=np.float64)[candidate_pos]
+                    mhrs = np.column_stack([
+                        raw_results[f'MHR_{v}'].fillna(0).to_numpy(dtype=np.float64)[candidate_pos]
+                        if f'MHR_{v}' in raw_results.columns else np.zeros(len(candidate_pos))
+                        for v in vendor_names
+                    ]) if vendor_names else np.zeros((len(candidate_pos), 0))
+                    container_caps = np.array([
+                        other_vendor_caps.get(v, {}).get('kontainer', 0) if use_container_filter else np.inf for v in vendor_names
+                    ], dtype=np.float64)
+                    mhr_caps = np.array([
+                        other_vendor_caps.get(v, {}).get('mhr', 0) if use_mhr_filter else np.inf for v in vendor_names
+                    ], dtype=np.float64)
+
+                    alloc_idx = greedy_vendor_allocation(prices, mhrs, container_caps, mhr_caps)
+
+                    # Baris yang mendapat vendor lain; sisanya tetap Tidak Terhandle
+                    rows_ok = np.flatnonzero(alloc_idx >= 0)
+                    vendor_ok = alloc_idx[rows_ok]
+                    ov_pos = candidate_pos[rows_ok]
+                    alokasi[ov_pos] = np.array(vendor_names, dtype=object)[vendor_ok]
+                    harga_final[ov_pos] = prices[rows_ok, vendor_ok]
+                    pred_other = raw_results[[f'PREDIKSI_{v}' for v in vendor_names]].to_numpy(dtype=np.float64)
+                    biaya_total_alokasi[ov_pos] = pred_other[ov_pos, vendor_ok] # Selalu simpan biaya total aktual
+
+                final_df = raw_results.assign(
+                    ALOKASI=pd.Categorical(alokasi),
+                    HARGA_FINAL=harga_final,
+                    BIAYA_TOTAL_ALOKASI=biaya_total_alokasi
+                )
                                                                 
                 return final_df
             except Exception as e:
@@ -615,11 +975,15 @@ if pipeline:
                 file_name = uploaded_file.name
                 spil_today_caps = {"kontainer": spil_container_capacity, "mhr": spil_mhr_capacity}
                 with st.spinner(f'Menjalankan alokasi dengan algoritma "{allocation_method}"...'):
-                    final_results = run_spil_centric_allocation(
-                        pipeline, uploaded_file_content, file_name, depo_option, allocation_method,
+                    raw_results = prepare_bulk_results(
+                        pipeline, MASTER_VERSION, uploaded_file_content, file_name, depo_option,
                         priority_filter_options, # <-- Menggunakan variabel baru (list)
-                        spil_today_caps, other_vendor_capacities_input, use_other_vendors,
-                        use_container_filter, use_mhr_filter, calculation_option
+                        calculation_option
+                    )
+                    final_results = run_spil_centric_allocation(
+                        raw_results, pipeline.vendors_by_depo.get(depo_option, []), allocation_method,
+                        spil_today_caps, other_vendor_capacities_input,
+                        use_other_vendors, use_container_filter, use_mhr_filter
                     )
                 
                 if not final_results.empty:
@@ -629,18 +993,24 @@ if pipeline:
                     if total_warnings > 0:
                         st.warning(f"⚠️ Total ada {int(total_warnings)} material bermasalah (tidak ditemukan atau data tidak lengkap) yang mempengaruhi hasil estimasi.")
                     
-                    def get_final_mhr(row):
-                        if pd.isna(row['ALOKASI']) or 'Tidak Terhandle' in row['ALOKASI']: return np.nan
-                        if 'SPIL' in row['ALOKASI']: vendor = 'SPIL'
-                        else: vendor = row['ALOKASI']
-                        return row.get(f"MHR_{vendor}", np.nan)
-                    final_results['MHR'] = final_results.apply(get_final_mhr, axis=1)
+                    # MHR final diambil dari kolom MHR_<vendor> sesuai alokasi tiap baris (tanpa apply per baris)
+                    alokasi = final_results['ALOKASI'].astype(object)
+                    vendor_final = alokasi.where(~alokasi.str.contains('SPIL', na=False, regex=False), 'SPIL')
+                    vendor_final = vendor_final.mask(alokasi.str.contains('Tidak Terhandle', na=False, regex=False))
+                    mhr_codes, mhr_vendors = pd.factorize(vendor_final)
+                    mhr_cols = [f"MHR_{v}" for v in mhr_vendors]
+                    nan_col = np.full(len(final_results), np.nan)
+                    # Kolom NaN terakhir menampung kode -1 (Tidak Terhandle / kosong) dan kolom MHR yang tidak ada
+                    mhr_matrix = np.column_stack(
+                        [final_results[c].to_numpy(dtype=float) if c in final_results.columns else nan_col for c in mhr_cols] + [nan_col]
+                    )
+                    final_results['MHR'] = mhr_matrix[np.arange(len(final_results)), mhr_codes]
 
                     st.markdown("---")
                     st.subheader("Ringkasan Hasil Alokasi")
                     
                     # --- PERUBAHAN DI SINI: Gunakan 'BIAYA_TOTAL_ALOKASI' untuk agregasi ---
-                    vendor_stats = final_results.groupby('ALOKASI').agg(
+                    vendor_stats = final_results.groupby('ALOKASI', observed=True).agg(
                         Jumlah_Kontainer=('NO_EOR', 'nunique'),
                         Total_Biaya=('BIAYA_TOTAL_ALOKASI', 'sum'), # Menggunakan kolom biaya total yang benar
                         Total_MHR=('MHR', 'sum'),
@@ -702,17 +1072,20 @@ if pipeline:
                     # --- AKHIR PERUBAHAN ---
 
                     display_cols_exist = [col for col in display_cols if col in final_results.columns]
-                    display_df = final_results[display_cols_exist].rename(columns=rename_map_detail)
+                    detail_df = final_results[display_cols_exist]
+                    sorted_display_df = prepare_display_table(
+                        detail_df, dataframe_content_key(detail_df), rename_map_detail, (sort_key_display,)
+                    )
                     
-                    st.dataframe(
-                        display_df.sort_values(by=sort_key_display, ascending=False).style.format(format_map_detail, na_rep='-'),
-                        height=600, use_container_width=True
+                    show_result_table(sorted_display_df, format_map_detail, download_format)
+
+                    # File download baru diserialisasi saat tombol diklik (callable), bukan di setiap render;
+                    # on_click="ignore" agar klik download tidak me-rerun dan menghapus hasil di layar
+                    st.download_button(
+                        label="Download Hasil Alokasi",
+                        data=partial(download_bytes, sorted_display_df, download_format),
+                        file_name=f"hasil_alokasi_{depo_option}.{download_ext}", mime=download_mime, on_click="ignore"
                     )
-
-                    sorted_display_df = display_df.sort_values(by=sort_key_display, ascending=False)
-
-                    csv_final = sorted_display_df.to_csv(index=False).encode('utf-8')
-                    st.download_button(label="Download Hasil Alokasi", data=csv_final, file_name=f"hasil_alokasi_{depo_option}.csv", mime="text/csv")
                     
                     with st.expander("Lihat Tabel Alokasi Lengkap", expanded=False):
                         st.caption("Tabel ini menampilkan hasil alokasi final dan semua detail kalkulasi.")
@@ -729,53 +1102,21 @@ if pipeline:
                         comprehensive_cols_exist = [col for col in comprehensive_cols if col in final_results.columns]
                         detail_df_comprehensive = final_results[comprehensive_cols_exist]
                         
-                        rename_map_comprehensive = {
-                            'HARGA_FINAL': 'Biaya Final', 'NO_EOR': 'No EOR', 'CONTAINER_TYPE': 'Tipe Kontainer',
-                            'ALOKASI': 'Alokasi', 'Selisih_Prediksi_Biaya': 'Potensi Keuntungan (Total)',
-                            'Selisih_Harga_per_MHR': 'Potensi Keuntungan (per MHR)', 'MHR': 'MHR Final',
-                            'WARNING_COUNT': 'Jml Material Bermasalah',
-                            'JUMLAH_MATERIAL': 'Total Material'
-                        }
-                        format_dict_full = {
-                            'Biaya Final': 'Rp {:,.0f}', 'MHR Final': '{:,.2f}',
-                            'Potensi Keuntungan (Total)': 'Rp {:,.0f}', 'Potensi Keuntungan (per MHR)': 'Rp {:,.0f}/jam',
-                            'Jml Material Bermasalah': '{:,.0f}',
-                            'Total Material': '{:,.0f}'
-                        }
+                        rename_map_comprehensive, format_dict_full = build_comprehensive_maps(tuple(detail_df_comprehensive.columns))
 
-                        for col in detail_df_comprehensive.columns:
-                            if col.startswith('PREDIKSI_') and not col.startswith('PREDIKSI/MHR_'):
-                                new_name = col.replace('PREDIKSI_', 'Biaya ')
-                                rename_map_comprehensive[col] = new_name
-                                format_dict_full[new_name] = 'Rp {:,.0f}'
-                            elif col.startswith('MHR_'):
-                                new_name = col.replace('MHR_', 'MHR ')
-                                rename_map_comprehensive[col] = new_name
-                                format_dict_full[new_name] = '{:,.2f}'
-                            elif col.startswith('PREDIKSI/MHR_'):
-                                new_name = col.replace('PREDIKSI/MHR_', 'Biaya/MHR ')
-                                rename_map_comprehensive[col] = new_name
-                                format_dict_full[new_name] = 'Rp {:,.0f}/jam'
-                        
-                        display_df_renamed = detail_df_comprehensive.rename(columns=rename_map_comprehensive)
-                        
-                        sort_column = 'Potensi Keuntungan (Total)'
-                        if sort_column not in display_df_renamed.columns:
-                            sort_column = 'No EOR'
-                        sorted_df = display_df_renamed.sort_values(by=sort_column, ascending=False)
-                        
-                        st.dataframe(
-                            sorted_df.style.format(format_dict_full, na_rep='-'),
-                            height=600,
-                            use_container_width=True
+                        sorted_df = prepare_display_table(
+                            detail_df_comprehensive, dataframe_content_key(detail_df_comprehensive),
+                            rename_map_comprehensive, ('Potensi Keuntungan (Total)', 'No EOR')
                         )
-                        csv_pred_detail = sorted_df.to_csv(index=False).encode('utf-8')
+                        
+                        show_result_table(sorted_df, format_dict_full, download_format)
                         st.download_button(
                             label="Download Tabel Lengkap",
-                            data=csv_pred_detail,
-                            file_name=f"prediksi_super_lengkap_{depo_option}.csv",
-                            mime="text/csv",
-                            key="download_super_lengkap"
+                            data=partial(download_bytes, sorted_df, download_format),
+                            file_name=f"prediksi_super_lengkap_{depo_option}.{download_ext}",
+                            mime=download_mime,
+                            key="download_super_lengkap",
+                            on_click="ignore"
                         )
 
                     # --- PERUBAHAN LOGIKA PERINGATAN (BAGIAN TAMPILAN) ---
@@ -785,17 +1126,14 @@ if pipeline:
                             file_extension_check = file_name.split('.')[-1].lower()
                             data_raw_check = None
                             if file_extension_check == 'csv':
-                                content_str_check = uploaded_file_content.decode('utf-8')
-                                data_raw_check = pd.read_csv(StringIO(content_str_check), sep=None, engine='python')
-                            elif file_extension_check in ['xlsx', 'xls']:
-                                data_raw_check = pd.read_excel(BytesIO(uploaded_file_content))
-                            elif file_extension_check == 'ods':
-                                data_raw_check = pd.read_excel(BytesIO(uploaded_file_content), engine='odf')
+                                data_raw_check = read_csv_sniffed(uploaded_file_content.decode('utf-8'))
+                            elif file_extension_check in ['xlsx', 'xls', 'ods']:
+                                data_raw_check = read_excel_upload(uploaded_file_content, file_extension_check)
                             
                             if data_raw_check is not None and not data_raw_check.empty:
-                                data_raw_check.columns = data_raw_check.columns.str.strip()
+                                data_raw_check = data_raw_check.rename(columns=strip_column_name)
                                 if 'MATERIAL' in data_raw_check.columns:
-                                    data_raw_check['MATERIAL'] = data_raw_check['MATERIAL'].astype(str).str.strip()
+                                    data_raw_check['MATERIAL'] = strip_text(data_raw_check['MATERIAL'])
                                     
                                     # 1. Cari material yang tidak ada di master
                                     master_materials_set = set(master_material_df['MATERIAL'])